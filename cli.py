@@ -47,6 +47,7 @@ def recover_node(node_id):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="CLI for KubernetesKubesim")
+    parser.add_argument("--base-url", default=BASE_URL, help="Simulator address (default: %(default)s)")
     parser.add_argument("--list-nodes", action="store_true", help="List all nodes")
     parser.add_argument("--list-pods", action="store_true", help="List all pods")
     parser.add_argument("--add-node", nargs=2, metavar=("NODE_ID", "CPU"), help="Add a node with given CPU")
@@ -55,6 +56,7 @@ if __name__ == "__main__":
     parser.add_argument("--recover-node", metavar="NODE_ID", help="Recover a previously failed node")
 
     args = parser.parse_args()
+    BASE_URL = args.base_url
 
     if args.list_nodes:
         list_nodes()
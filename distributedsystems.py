@@ -1,183 +1,530 @@
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
+import argparse
+import itertools
 import threading
 import time
-import subprocess
 import logging
+import os
+import queue
 import sqlite3
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import orjson
+from sortedcontainers import SortedList
+
+class ORJSONProvider(JSONProvider):
+    """Serve jsonify() and request.get_json() through orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response, skipping the str round trip.
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 logging.basicConfig(level=logging.INFO)
 
-db_file = "cluster.db"
-lock = threading.RLock()
+# The simulator rebuilds its tables at boot, so the live database is a shared
+# in-memory one and commits never wait on disk. snapshot_db() periodically
+# copies it to snapshot_file. The database is private to this process, so a
+# second simulator instance only needs its own KUBESIM_SNAPSHOT path.
+db_file = "file:cluster?mode=memory&cache=shared"
+snapshot_file = os.environ.get("KUBESIM_SNAPSHOT", "cluster.db")
+SNAPSHOT_INTERVAL = 30
+
+# /heartbeat only updates the node cache and queues the timestamp;
+# heartbeat_writer persists them in batches of up to HEARTBEAT_BATCH_SIZE
+# distinct nodes, collected for at most HEARTBEAT_FLUSH_INTERVAL seconds.
+HEARTBEAT_BATCH_SIZE = 500
+HEARTBEAT_FLUSH_INTERVAL = 0.1
+heartbeat_queue = queue.Queue()
+
+# Set KUBESIM_RESTORE=1 to start from the last snapshot instead of empty tables.
+RESTORE_SNAPSHOT = os.environ.get("KUBESIM_RESTORE") == "1"
+
+# ---------------- Connection Pool ----------------
+PRAGMAS = """
+    PRAGMA busy_timeout=5000;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-20000;
+"""
+
+# Shared-cache readers would otherwise hit "table is locked" whenever the
+# writer has a transaction open; reads here are monitoring views and may see
+# in-flight writes.
+READ_PRAGMAS = """
+    PRAGMA read_uncommitted=1;
+    PRAGMA query_only=1;
+"""
+
+def get_conn(isolation_level="DEFERRED"):
+    conn = sqlite3.connect(db_file, uri=True, check_same_thread=False, isolation_level=isolation_level)
+    conn.executescript(PRAGMAS)
+    return conn
+
+class ConnectionPool:
+    """Fixed set of long-lived connections shared by request and background threads.
+
+    Reusing connections skips the per-request open and pragma setup, and keeps
+    each connection's prepared statement cache warm across requests. The
+    in-memory database lives as long as any of these connections is open.
+    """
+
+    def __init__(self, size=8, isolation_level="DEFERRED", readonly=False):
+        self._idle = queue.Queue(maxsize=size)
+        for _ in range(size):
+            conn = get_conn(isolation_level)
+            if readonly:
+                conn.executescript(READ_PRAGMAS)
+            self._idle.put(conn)
+
+    @contextmanager
+    def acquire(self):
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            # Never hand a half-finished transaction to the next borrower.
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+# Reads run in parallel on their own connections. All writes go through the
+# single write connection, which serializes them, and open with
+# BEGIN IMMEDIATE so a write transaction holds its lock from the start.
+# Writers also update the node cache before releasing the connection, so
+# node_state always matches the last commit.
+read_pool = ConnectionPool(size=8, readonly=True)
+write_pool = ConnectionPool(size=1, isolation_level="IMMEDIATE")
 
 # ---------------- Database Init ----------------
 def init_db():
-    with sqlite3.connect(db_file, check_same_thread=False) as conn:
-        cursor = conn.cursor()
+    with write_pool.acquire() as conn:
+        conn.executescript("""
+            BEGIN;
 
-        cursor.execute("DROP TABLE IF EXISTS nodes")
-        cursor.execute("""
+            DROP TABLE IF EXISTS nodes;
             CREATE TABLE nodes (
                 node_id TEXT PRIMARY KEY,
                 cpu INTEGER,
                 last_heartbeat REAL,
                 status TEXT DEFAULT 'healthy'
-            )
-        """)
+            );
 
-        cursor.execute("DROP TABLE IF EXISTS pods")
-        cursor.execute("""
+            DROP TABLE IF EXISTS pods;
             CREATE TABLE pods (
                 pod_id TEXT PRIMARY KEY,
                 cpu INTEGER,
                 node_id TEXT,
                 status TEXT DEFAULT 'pending',
                 FOREIGN KEY (node_id) REFERENCES nodes (node_id)
-            )
-        """)
+            );
+            -- Eviction and rescheduling look pods up by node (including IS NULL
+            -- for pending pods) and metrics counts them by status.
+            CREATE INDEX idx_pods_node_id ON pods (node_id);
+            CREATE INDEX idx_pods_status ON pods (status);
 
-        cursor.execute("DROP TABLE IF EXISTS settings")
-        cursor.execute('''CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )''')
+            DROP TABLE IF EXISTS settings;
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
 
-        # Ensure a default strategy exists
-        cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('strategy', 'best_fit')")
-        cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('leader', 'none')")
+            -- Ensure a default strategy exists
+            INSERT OR IGNORE INTO settings (key, value) VALUES ('strategy', 'best_fit');
+            INSERT OR IGNORE INTO settings (key, value) VALUES ('leader', 'none');
 
-        conn.commit()
+            COMMIT;
+        """)
 
-init_db()
+def restore_db():
+    """Load the last snapshot into the in-memory database."""
+    src = sqlite3.connect(snapshot_file)
+    try:
+        with write_pool.acquire() as conn:
+            src.backup(conn)
+    finally:
+        src.close()
+
+# ---------------- Node Cache ----------------
+# Live node state is kept in process memory and read from here. Structural
+# changes (add/remove/fail/recover/allocate) are written to SQLite directly;
+# heartbeats are persisted in batches by heartbeat_writer.
+@dataclass
+class NodeRec:
+    cpu: int
+    last_heartbeat: float
+    status: str = "healthy"
+    seq: int = 0  # insertion order, assigned by track_node
+
+class FirstFitIndex:
+    """Max segment tree over nodes in insertion order.
+
+    Leaves hold each node's free CPU (-1 when it can't take pods) and inner
+    entries the max of their children, so the first node that fits is found
+    by one root-to-leaf descent instead of scanning node_state.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._size = 1
+        self._tree = [-1, -1]
+        self._ids = []
+        self._slot = {}
+
+    def set(self, node_id, cpu):
+        slot = self._slot.get(node_id)
+        if slot is None:
+            if len(self._ids) == self._size:
+                self._rebuild()
+            slot = len(self._ids)
+            self._ids.append(node_id)
+            self._slot[node_id] = slot
+        self._update(slot, cpu)
+
+    def discard(self, node_id):
+        slot = self._slot.pop(node_id, None)
+        if slot is not None:
+            self._ids[slot] = None
+            self._update(slot, -1)
+
+    def first_fit(self, cpu_req):
+        cpu_req = max(cpu_req, 0)
+        tree = self._tree
+        if tree[1] < cpu_req:
+            return None
+        i = 1
+        while i < self._size:
+            i = 2 * i if tree[2 * i] >= cpu_req else 2 * i + 1
+        return self._ids[i - self._size]
+
+    def _update(self, slot, cpu):
+        tree = self._tree
+        i = slot + self._size
+        tree[i] = cpu
+        i //= 2
+        while i:
+            tree[i] = max(tree[2 * i], tree[2 * i + 1])
+            i //= 2
+
+    def _rebuild(self):
+        # Out of leaves: drop slots freed by discard() and grow to at least
+        # twice the live count, keeping insertion order.
+        live = [(node_id, self._tree[self._size + slot])
+                for slot, node_id in enumerate(self._ids) if node_id is not None]
+        size = 1
+        while size <= 2 * len(live):
+            size *= 2
+        tree = [-1] * (2 * size)
+        for slot, (_, cpu) in enumerate(live):
+            tree[size + slot] = cpu
+        for i in range(size - 1, 0, -1):
+            tree[i] = max(tree[2 * i], tree[2 * i + 1])
+        self._size = size
+        self._tree = tree
+        self._ids = [node_id for node_id, _ in live]
+        self._slot = {node_id: slot for slot, node_id in enumerate(self._ids)}
+
+node_state = {}
+node_lock = threading.Lock()
+
+# (cpu, seq, node_id) for every healthy node, ordered by free CPU and then
+# insertion order, so best/worst fit are a bisect instead of a scan and CPU
+# ties go to the earliest node. Guarded by node_lock.
+free_cpu = SortedList()
+node_seq = itertools.count()
+
+# First fit keeps insertion order, which free_cpu can't answer. Guarded by node_lock.
+first_fit_index = FirstFitIndex()
+
+# Time of the last simulated cluster-wide heartbeat from auto_heartbeat, as
+# wall-clock for reporting and monotonic for timeout decisions.
+auto_heartbeat_at = 0.0
+auto_heartbeat_tick = 0.0
+
+def last_seen(rec):
+    return max(rec.last_heartbeat, auto_heartbeat_at)
+
+# The helpers below keep node_state, free_cpu and first_fit_index in step;
+# callers hold node_lock.
+def fit_cpu(rec):
+    return rec.cpu if rec.status == 'healthy' else -1
+
+def fit_key(node_id, rec, cpu=None):
+    return (rec.cpu if cpu is None else cpu, rec.seq, node_id)
+
+def track_node(node_id, rec):
+    rec.seq = next(node_seq)
+    node_state[node_id] = rec
+    first_fit_index.set(node_id, fit_cpu(rec))
+    if rec.status == 'healthy':
+        free_cpu.add(fit_key(node_id, rec))
+
+def untrack_node(node_id):
+    rec = node_state.pop(node_id, None)
+    first_fit_index.discard(node_id)
+    if rec and rec.status == 'healthy':
+        free_cpu.discard(fit_key(node_id, rec))
+
+def set_node_status(node_id, status):
+    rec = node_state.get(node_id)
+    if not rec or rec.status == status:
+        return
+    if rec.status == 'healthy':
+        free_cpu.discard(fit_key(node_id, rec))
+    rec.status = status
+    if status == 'healthy':
+        free_cpu.add(fit_key(node_id, rec))
+    first_fit_index.set(node_id, fit_cpu(rec))
+
+def set_node_cpu(node_id, cpu):
+    rec = node_state[node_id]
+    if rec.status == 'healthy':
+        free_cpu.discard(fit_key(node_id, rec))
+        free_cpu.add(fit_key(node_id, rec, cpu))
+    rec.cpu = cpu
+    first_fit_index.set(node_id, fit_cpu(rec))
+
+def load_node_state():
+    with read_pool.acquire() as conn:
+        rows = conn.execute("SELECT node_id, cpu, last_heartbeat, status FROM nodes").fetchall()
+    with node_lock:
+        node_state.clear()
+        free_cpu.clear()
+        first_fit_index.clear()
+        for node_id, cpu, last_heartbeat, status in rows:
+            track_node(node_id, NodeRec(cpu, last_heartbeat, status))
+
+def pick_node(strategy, cpu_req):
+    if strategy == "first_fit":
+        return first_fit_index.first_fit(cpu_req)
+
+    if strategy == "best_fit":
+        i = free_cpu.bisect_left((cpu_req,))
+        return free_cpu[i][2] if i < len(free_cpu) else None
+
+    if strategy == "worst_fit":
+        if free_cpu and free_cpu[-1][0] >= cpu_req:
+            # Earliest of the nodes sharing the most free CPU.
+            return free_cpu[free_cpu.bisect_left((free_cpu[-1][0],))][2]
+
+    return None
 
 # ---------------- Strategy Helper ----------------
-def get_current_strategy():
-    with sqlite3.connect(db_file, check_same_thread=False) as conn:
+# Read on every placement but rarely changed, so the strategy is cached here.
+# It is loaded from settings at startup and set_strategy updates both.
+current_strategy = "best_fit"
+
+def load_strategy():
+    global current_strategy
+    with read_pool.acquire() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT value FROM settings WHERE key='strategy'")
         row = cursor.fetchone()
-        return row[0] if row else "best_fit"
+    current_strategy = row[0] if row else "best_fit"
+
+STRATEGIES = ("first_fit", "best_fit", "worst_fit")
+
+def get_current_strategy():
+    return current_strategy
 
 # ---------------- Scheduling ----------------
-def run_command(cmd):
-    subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+def resync_nodes(conn, node_ids):
+    """Reload the CPU of node_ids from the table into the node cache."""
+    for node_id in node_ids:
+        row = conn.execute("SELECT cpu FROM nodes WHERE node_id = ?", (node_id,)).fetchone()
+        with node_lock:
+            if row:
+                set_node_cpu(node_id, row[0])
+            else:
+                untrack_node(node_id)
+
+def schedule_pod(conn, pod_id, cpu_req, strategy):
+    """Place pod_id inside the caller's open transaction.
+
+    Returns (node_id, remaining_cpu), or None if no node fits. The caller
+    commits and then applies the remaining CPU to the node cache.
+    """
+    cursor = conn.cursor()
+    while True:
+        with node_lock:
+            assigned_node = pick_node(strategy, cpu_req)
+        if not assigned_node:
+            return None
 
-def schedule_pod(pod_id, cpu_req):
-    strategy = get_current_strategy()
-    with lock, sqlite3.connect(db_file, check_same_thread=False) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT node_id, cpu, status FROM nodes WHERE status = 'healthy'")
-        nodes = cursor.fetchall()
-
-        assigned_node = None
-
-        if strategy == "first_fit":
-            for node_id, cpu, status in nodes:
-                if cpu >= cpu_req:
-                    assigned_node = node_id
-                    break
-
-        elif strategy == "best_fit":
-            best_node = None
-            min_cpu = float("inf")
-            for node_id, cpu, status in nodes:
-                if cpu >= cpu_req and cpu < min_cpu:
-                    min_cpu = cpu
-                    best_node = node_id
-            assigned_node = best_node
-
-        elif strategy == "worst_fit":
-            worst_node = None
-            max_leftover = -1
-            for node_id, cpu, status in nodes:
-                if cpu >= cpu_req and (cpu - cpu_req) > max_leftover:
-                    max_leftover = cpu - cpu_req
-                    worst_node = node_id
-            assigned_node = worst_node
-
-        if assigned_node:
-            cursor.execute("SELECT cpu FROM nodes WHERE node_id = ?", (assigned_node,))
-            available_cpu = cursor.fetchone()[0]
-            new_cpu = available_cpu - cpu_req
-            cursor.execute("UPDATE nodes SET cpu = ? WHERE node_id = ?", (new_cpu, assigned_node))
-            cursor.execute("UPDATE pods SET node_id = ?, status = 'running' WHERE pod_id = ?", (assigned_node, pod_id))
-            conn.commit()
-            logging.info(f"Pod {pod_id} scheduled on Node {assigned_node} with {strategy}")
-            return assigned_node
+        # Decrement and check in one statement so the allocation can never
+        # take a node below zero, whatever the cache believed.
+        cursor.execute(
+            "UPDATE nodes SET cpu = cpu - ? WHERE node_id = ? AND cpu >= ? RETURNING cpu",
+            (cpu_req, assigned_node, cpu_req)
+        )
+        row = cursor.fetchone()
+        if row:
+            break
 
-        return None
+        # The cache had drifted from the table for this node; resync it and pick again.
+        resync_nodes(conn, [assigned_node])
 
-def auto_reschedule():
-    while True:
-        time.sleep(15)
-        strategy = get_current_strategy()
-        with lock, sqlite3.connect(db_file, check_same_thread=False) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT pod_id, cpu FROM pods WHERE node_id IS NULL")
-            failed_pods = cursor.fetchall()
+    cursor.execute("UPDATE pods SET node_id = ?, status = 'running' WHERE pod_id = ?", (assigned_node, pod_id))
+    return assigned_node, row[0]
+
+def reschedule_pending():
+    """Place every pending pod in one pass and persist the result in a single commit."""
+    # Cheap probe on a read connection so an idle cluster never takes the writer.
+    with read_pool.acquire() as conn:
+        if not conn.execute("SELECT 1 FROM pods WHERE node_id IS NULL LIMIT 1").fetchone():
+            return
+
+    strategy = get_current_strategy()
+    with write_pool.acquire() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pod_id, cpu FROM pods WHERE node_id IS NULL")
+        failed_pods = cursor.fetchall()
+
+        # Allocate against the cache as we go so later pods see the CPU taken
+        # by earlier ones; taken is the total per node, written as one delta.
+        placements = []
+        taken = {}
+        with node_lock:
             for pod_id, cpu in failed_pods:
-                assigned_node = schedule_pod(pod_id, cpu)
+                assigned_node = pick_node(strategy, cpu)
                 if assigned_node:
-                    logging.info(f"[AUTO] Rescheduled pod {pod_id} to Node {assigned_node} using {strategy}")
+                    set_node_cpu(assigned_node, node_state[assigned_node].cpu - cpu)
+                    taken[assigned_node] = taken.get(assigned_node, 0) + cpu
+                    placements.append((assigned_node, pod_id))
+
+        if not placements:
+            return
+
+        try:
+            # Guarded deltas, as in schedule_pod, so a drifted cache can never
+            # drive a node below zero.
+            cursor.executemany(
+                "UPDATE nodes SET cpu = cpu - ? WHERE node_id = ? AND cpu >= ?",
+                [(cpu, node_id, cpu) for node_id, cpu in taken.items()]
+            )
+            if cursor.rowcount != len(taken):
+                # Some node didn't have the CPU the cache promised; drop the
+                # whole pass and let the next tick place the pods again.
+                conn.rollback()
+                resync_nodes(conn, taken)
+                logging.warning("[AUTO] Node cache out of step with the database; resynced")
+                return
+            cursor.executemany("UPDATE pods SET node_id = ?, status = 'running' WHERE pod_id = ?", placements)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            resync_nodes(conn, taken)
+            raise
+
+    for assigned_node, pod_id in placements:
+        logging.info(f"[AUTO] Rescheduled pod {pod_id} to Node {assigned_node} using {strategy}")
 
 # ---------------- API Endpoints ----------------
+def json_body():
+    """Parse the JSON body once without caching it; anything but an object reads as empty."""
+    data = request.get_json(silent=True, cache=False)
+    return data if isinstance(data, dict) else {}
+
+def valid_id(value):
+    return isinstance(value, str) and value != ""
+
+# Per-node cap well inside SQLite's signed 64-bit INTEGER, so the cluster-wide
+# sums in launch_pod and metrics stay serializable too.
+MAX_CPU = 2**31 - 1
+
+def valid_cpu(value):
+    # bool is an int subclass and floats would silently truncate; reject both.
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= MAX_CPU
+
 @app.route('/add_node', methods=['POST'])
 def add_node():
-    data = request.json
-    node_id, cpu = data['node_id'], data['cpu']
-    with lock, sqlite3.connect(db_file, check_same_thread=False) as conn:
+    data = json_body()
+    node_id, cpu = data.get('node_id'), data.get('cpu')
+    if not valid_id(node_id) or not valid_cpu(cpu):
+        return jsonify({'error': f'Expected string node_id and integer cpu in [0, {MAX_CPU}]'}), 400
+    with write_pool.acquire() as conn:
         cursor = conn.cursor()
-        cursor.execute("INSERT INTO nodes VALUES (?, ?, ?, 'healthy')", (node_id, cpu, time.time()))
+        now = time.time()
+        cursor.execute("INSERT INTO nodes VALUES (?, ?, ?, 'healthy')", (node_id, cpu, now))
         conn.commit()
+        with node_lock:
+            track_node(node_id, NodeRec(cpu, now))
     return jsonify({'message': f'Node {node_id} added'})
 
 @app.route('/scale', methods=['POST'])
 def scale():
-    count = int(request.args.get("count", 1))
+    try:
+        count = int(request.args.get("count", 1))
+    except ValueError:
+        return jsonify({'error': 'count must be an integer'}), 400
     responses = []
     for i in range(count):
         node_id = f"node_auto_{int(time.time())}_{i}"
         cpu = 10  # default CPU per node
-        with lock, sqlite3.connect(db_file, check_same_thread=False) as conn:
+        with write_pool.acquire() as conn:
             cursor = conn.cursor()
-            cursor.execute("INSERT INTO nodes VALUES (?, ?, ?, 'healthy')", (node_id, cpu, time.time()))
+            now = time.time()
+            cursor.execute("INSERT INTO nodes VALUES (?, ?, ?, 'healthy')", (node_id, cpu, now))
             conn.commit()
+            with node_lock:
+                track_node(node_id, NodeRec(cpu, now))
         responses.append(node_id)
     return jsonify({'message': f'Scaled up by {count} nodes', 'nodes': responses})
 
 @app.route('/launch_pod', methods=['POST'])
 def launch_pod():
-    data = request.json
-    pod_id = data['pod_id']
-    cpu_req = data['cpu']
+    data = json_body()
+    pod_id, cpu_req = data.get('pod_id'), data.get('cpu')
+    if not valid_id(pod_id) or not valid_cpu(cpu_req):
+        return jsonify({'error': f'Expected string pod_id and integer cpu in [0, {MAX_CPU}]'}), 400
 
-    with lock, sqlite3.connect(db_file, check_same_thread=False) as conn:
+    strategy = get_current_strategy()
+    with write_pool.acquire() as conn:
         cursor = conn.cursor()
+        # Take the write lock up front so the capacity check, insert and
+        # placement commit together and nothing can claim the CPU in between.
+        cursor.execute("BEGIN IMMEDIATE")
         cursor.execute("SELECT 1 FROM pods WHERE pod_id = ?", (pod_id,))
         if cursor.fetchone():
             return jsonify({'error': f'Pod {pod_id} already exists'}), 400
 
         current_time = time.time()
-        cursor.execute("SELECT SUM(cpu) FROM nodes WHERE ? - last_heartbeat <= 30", (current_time,))
-        total_available_cpu = cursor.fetchone()[0] or 0
+        with node_lock:
+            total_available_cpu = sum(rec.cpu for rec in node_state.values()
+                                      if current_time - last_seen(rec) <= 30)
 
         if total_available_cpu < cpu_req:
             return jsonify({'error': 'Insufficient cluster-wide resources'}), 400
 
         cursor.execute("INSERT INTO pods (pod_id, cpu, node_id, status) VALUES (?, ?, NULL, 'pending')",
                        (pod_id, cpu_req))
+        placement = schedule_pod(conn, pod_id, cpu_req, strategy)
         conn.commit()
-
-    assigned_node = schedule_pod(pod_id, cpu_req)
-    if assigned_node:
-        return jsonify({'message': f'Pod {pod_id} launched on Node {assigned_node} using {get_current_strategy()}'})
+        if placement:
+            with node_lock:
+                set_node_cpu(*placement)
+
+    if placement:
+        assigned_node = placement[0]
+        logging.info(f"Pod {pod_id} scheduled on Node {assigned_node} with {strategy}")
+        return jsonify({'message': f'Pod {pod_id} launched on Node {assigned_node} using {strategy}'})
     else:
         return jsonify({'error': 'No node can handle pod'}), 400
 
 @app.route('/leader', methods=['GET'])
 def leader():
-    with lock, sqlite3.connect(db_file, check_same_thread=False) as conn:
+    with write_pool.acquire() as conn:
         cursor = conn.cursor()
 
         # Fetch current leader from settings
@@ -212,8 +559,15 @@ def leader():
 
 @app.route('/set_strategy', methods=['POST'])
 def set_strategy():
-    strategy = request.json.get("strategy", "best_fit")
-    with sqlite3.connect(db_file) as conn:
+    strategy = json_body().get("strategy", "best_fit")
+    if strategy not in STRATEGIES:
+        return jsonify({'error': f'Unknown strategy {strategy}'}), 400
+    save_strategy(strategy)
+    return jsonify({'message': f'Strategy set to {strategy}'})
+
+def save_strategy(strategy):
+    global current_strategy
+    with write_pool.acquire() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS settings (
@@ -226,7 +580,7 @@ def set_strategy():
             ("strategy", strategy)
         )
         conn.commit()
-    return jsonify({'message': f'Strategy set to {strategy}'})
+        current_strategy = strategy
 
 @app.route("/get_strategy", methods=["GET"])
 def get_strategy():
@@ -234,30 +588,28 @@ def get_strategy():
 
 @app.route('/metrics', methods=['GET'])
 def metrics():
-    with lock, sqlite3.connect(db_file, check_same_thread=False) as conn:
+    with node_lock:
+        healthy = [rec.cpu for rec in node_state.values() if rec.status == 'healthy']
+    with read_pool.acquire() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*), SUM(cpu) FROM nodes WHERE status='healthy'")
-        node_count, total_cpu = cursor.fetchone()
         cursor.execute("SELECT COUNT(*) FROM pods WHERE status='running'")
         running_pods = cursor.fetchone()[0]
     return jsonify({
-        'healthy_nodes': node_count or 0,
-        'total_cpu': total_cpu or 0,
+        'healthy_nodes': len(healthy),
+        'total_cpu': sum(healthy),
         'running_pods': running_pods
     })
 
 @app.route('/list_nodes', methods=['GET'])
 def list_nodes():
-    with lock, sqlite3.connect(db_file, check_same_thread=False) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT node_id, cpu, last_heartbeat, status FROM nodes")
-        node_list = cursor.fetchall()
-    return jsonify([{ 'node_id': node_id, 'cpu': cpu, 'last_heartbeat': last_heartbeat, 'status': status} 
-                    for node_id, cpu, last_heartbeat, status in node_list])
+    with node_lock:
+        node_list = [{'node_id': node_id, 'cpu': rec.cpu, 'last_heartbeat': last_seen(rec), 'status': rec.status}
+                     for node_id, rec in node_state.items()]
+    return jsonify(node_list)
 
 @app.route('/pod_usage', methods=['GET'])
 def pod_usage():
-    with lock, sqlite3.connect(db_file, check_same_thread=False) as conn:
+    with read_pool.acquire() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT pod_id, cpu, node_id, status FROM pods")
         pod_list = cursor.fetchall()
@@ -266,7 +618,7 @@ def pod_usage():
 
 @app.route('/remove_node/<node_id>', methods=['DELETE'])
 def remove_node(node_id):
-    with lock, sqlite3.connect(db_file, check_same_thread=False) as conn:
+    with write_pool.acquire() as conn:
         cursor = conn.cursor()
         # Check if node exists
         cursor.execute("SELECT * FROM nodes WHERE node_id=?", (node_id,))
@@ -278,76 +630,193 @@ def remove_node(node_id):
         # Delete the node
         cursor.execute("DELETE FROM nodes WHERE node_id=?", (node_id,))
         conn.commit()
+        with node_lock:
+            untrack_node(node_id)
 
     return jsonify({"message": f"Node {node_id} removed successfully"})
 
 
 @app.route('/fail_node', methods=['POST'])
 def fail_node():
-    data = request.json
-    node_id = data['node_id']
-    with lock, sqlite3.connect(db_file, check_same_thread=False) as conn:
+    node_id = json_body().get('node_id')
+    if not valid_id(node_id):
+        return jsonify({'error': 'Expected string node_id'}), 400
+    with write_pool.acquire() as conn:
         cursor = conn.cursor()
         cursor.execute("UPDATE nodes SET status = 'unhealthy' WHERE node_id = ?", (node_id,))
         cursor.execute("UPDATE pods SET node_id = NULL, status = 'pending' WHERE node_id = ?", (node_id,))
         conn.commit()
+        with node_lock:
+            set_node_status(node_id, 'unhealthy')
     logging.warning(f"Node {node_id} marked failed; pods evicted")
     return jsonify({'message': f'Node {node_id} failed'})
 
 @app.route('/recover_node', methods=['POST'])
 def recover_node():
-    data = request.json
-    node_id = data['node_id']
-    with lock, sqlite3.connect(db_file, check_same_thread=False) as conn:
+    node_id = json_body().get('node_id')
+    if not valid_id(node_id):
+        return jsonify({'error': 'Expected string node_id'}), 400
+    with write_pool.acquire() as conn:
         cursor = conn.cursor()
+        now = time.time()
         cursor.execute("UPDATE nodes SET status = 'healthy', last_heartbeat = ? WHERE node_id = ?",
-                       (time.time(), node_id))
+                       (now, node_id))
         conn.commit()
+        with node_lock:
+            set_node_status(node_id, 'healthy')
+            if node_id in node_state:
+                node_state[node_id].last_heartbeat = now
     logging.info(f"Node {node_id} recovered")
     return jsonify({'message': f'Node {node_id} healthy again'})
 
 @app.route("/heartbeat", methods=["POST"])
 def heartbeat():
-    data = request.get_json()
-    node = data.get("node_id")
+    # Form posts skip JSON decoding entirely on the hottest endpoint.
+    if request.mimetype == "application/x-www-form-urlencoded":
+        node = request.form.get("node_id")
+    else:
+        node = json_body().get("node_id")
 
-    if not node:
+    if not valid_id(node):
         return jsonify({"error": "Missing node field"}), 400
 
-    with lock, sqlite3.connect(db_file) as conn:
-        conn.execute(
+    now = int(time.time())
+    with node_lock:
+        rec = node_state.get(node)
+        if rec:
+            rec.last_heartbeat = now
+    if rec:
+        heartbeat_queue.put((node, now))
+
+    return jsonify({"message": f"Heartbeat received from {node}"}), 200
+
+# ---------------- Background Threads ----------------
+stop_event = threading.Event()
+
+def run_every(interval, task):
+    """Run task every interval seconds on the monotonic clock until stop_event is set."""
+    next_run = time.monotonic() + interval
+    while not stop_event.wait(max(0, next_run - time.monotonic())):
+        try:
+            task()
+        except Exception:
+            # Last-resort handler: a failing pass must not end the loop.
+            logging.exception(f"Background task {task.__name__} failed")
+        # Skip ticks missed while the task overran instead of bursting to catch up.
+        next_run = max(next_run + interval, time.monotonic())
+
+def flush_heartbeats():
+    """Persist one coalesced batch of queued heartbeats in a single transaction."""
+    try:
+        node, ts = heartbeat_queue.get(timeout=1)
+    except queue.Empty:
+        return
+    latest = {node: ts}
+    deadline = time.monotonic() + HEARTBEAT_FLUSH_INTERVAL
+    while len(latest) < HEARTBEAT_BATCH_SIZE:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            break
+        try:
+            node, ts = heartbeat_queue.get(timeout=timeout)
+        except queue.Empty:
+            break
+        latest[node] = max(ts, latest.get(node, ts))
+
+    with write_pool.acquire() as conn:
+        conn.executemany(
             "UPDATE nodes SET last_heartbeat = ? WHERE node_id = ?",
-            (int(time.time()), node)
+            [(ts, node) for node, ts in latest.items()]
         )
         conn.commit()
 
-    return jsonify({"message": f"Heartbeat received from {node}"}), 200
+def heartbeat_writer():
+    while not stop_event.is_set():
+        try:
+            flush_heartbeats()
+        except Exception:
+            logging.exception("Failed to persist heartbeats")
 
-# ---------------- Background Threads ----------------
 def heartbeat_checker():
-    while True:
-        time.sleep(10)
-        with lock, sqlite3.connect(db_file, check_same_thread=False) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT node_id FROM nodes WHERE ? - last_heartbeat > 30", (time.time(),))
-            failed_nodes = cursor.fetchall()
-            for (node_id,) in failed_nodes:
-                logging.warning(f"Node {node_id} failed (timeout)!")
-                cursor.execute("UPDATE nodes SET status = 'unhealthy' WHERE node_id = ?", (node_id,))
-                cursor.execute("UPDATE pods SET node_id = NULL, status = 'pending' WHERE node_id = ?", (node_id,))
-            conn.commit()
+    current_time = time.time()
+    # While the simulated heartbeat is fresh no node can have timed out. Use
+    # the monotonic clock so a wall-clock jump can't fail the whole cluster.
+    if time.monotonic() - auto_heartbeat_tick <= 30:
+        return
 
-def auto_heartbeat():
-    while True:
-        time.sleep(5)
-        with lock, sqlite3.connect(db_file, check_same_thread=False) as conn:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE nodes SET last_heartbeat = ?", (time.time(),))
-            conn.commit()
+    with write_pool.acquire() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE nodes SET status = 'unhealthy' WHERE ? - last_heartbeat > 30 AND status = 'healthy' RETURNING node_id",
+            (current_time,)
+        )
+        failed_nodes = [node_id for (node_id,) in cursor.fetchall()]
+        if not failed_nodes:
+            return
+        cursor.execute("""
+            UPDATE pods SET node_id = NULL, status = 'pending'
+            WHERE node_id IN (SELECT node_id FROM nodes WHERE status = 'unhealthy')
+        """)
+        conn.commit()
+        with node_lock:
+            for node_id in failed_nodes:
+                set_node_status(node_id, 'unhealthy')
 
-threading.Thread(target=heartbeat_checker, daemon=True).start()
-threading.Thread(target=auto_heartbeat, daemon=True).start()
-threading.Thread(target=auto_reschedule, daemon=True).start()
+    for node_id in failed_nodes:
+        logging.warning(f"Node {node_id} failed (timeout)!")
+
+def auto_heartbeat():
+    # Simulated heartbeat for every node: bump one timestamp instead of
+    # rewriting last_heartbeat on every row.
+    global auto_heartbeat_at, auto_heartbeat_tick
+    auto_heartbeat_at = time.time()
+    auto_heartbeat_tick = time.monotonic()
+
+def snapshot_db():
+    """Copy the in-memory database to snapshot_file."""
+    # backup() replaces the destination inside one transaction, so a reader
+    # never sees a partial copy, and writing in place keeps working when
+    # snapshot_file is a bind-mounted single file. Back up from the write
+    # connection so the copy never includes a half-applied transaction.
+    with write_pool.acquire() as conn:
+        dst = sqlite3.connect(snapshot_file)
+        try:
+            conn.backup(dst)
+        finally:
+            dst.close()
+
+_threads_started = False
+
+def start_background_threads():
+    global _threads_started
+    if _threads_started:
+        return
+    _threads_started = True
+    auto_heartbeat()
+    for interval, task in ((10, heartbeat_checker),
+                           (5, auto_heartbeat),
+                           (15, reschedule_pending),
+                           (SNAPSHOT_INTERVAL, snapshot_db)):
+        threading.Thread(target=run_every, args=(interval, task), daemon=True).start()
+    threading.Thread(target=heartbeat_writer, daemon=True).start()
+
+# ---------------- Startup ----------------
+if RESTORE_SNAPSHOT and os.path.exists(snapshot_file):
+    restore_db()
+else:
+    init_db()
+load_node_state()
+load_strategy()
+start_background_threads()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    parser = argparse.ArgumentParser(description="KubernetesKubesim cluster simulator")
+    parser.add_argument("--port", type=int, default=5001, help="Port to listen on")
+    parser.add_argument("--strategy", choices=STRATEGIES, help="Scheduling strategy to start with")
+    args = parser.parse_args()
+
+    if args.strategy:
+        save_strategy(args.strategy)
+
+    # Development only; serve through gunicorn (see README) for real load.
+    app.run(host='0.0.0.0', port=args.port)
@@ -0,0 +1,66 @@
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# Importing the module boots the simulator; keep its snapshot out of the repo.
+os.environ.setdefault("KUBESIM_SNAPSHOT", os.path.join(tempfile.mkdtemp(), "cluster.db"))
+
+from distributedsystems import FirstFitIndex
+
+
+def scan_first_fit(nodes, cpu_req):
+    # The linear scan FirstFitIndex replaced: first node in insertion order that fits.
+    cpu_req = max(cpu_req, 0)
+    return next((node_id for node_id, cpu in nodes.items() if cpu >= cpu_req), None)
+
+
+def test_matches_linear_scan_under_random_operations():
+    rng = random.Random(1)
+    index = FirstFitIndex()
+    nodes = {}
+    next_id = 0
+    for _ in range(20000):
+        op = rng.random()
+        if op < 0.3 or not nodes:
+            next_id += 1
+            node_id = f"n{next_id}"
+            cpu = rng.choice([-1, rng.randint(0, 20)])
+            index.set(node_id, cpu)
+            nodes[node_id] = cpu
+        elif op < 0.45:
+            node_id = rng.choice(list(nodes))
+            index.discard(node_id)
+            del nodes[node_id]
+        elif op < 0.7:
+            node_id = rng.choice(list(nodes))
+            cpu = rng.choice([-1, rng.randint(0, 20)])
+            index.set(node_id, cpu)
+            nodes[node_id] = cpu
+        else:
+            cpu_req = rng.randint(-2, 22)
+            assert index.first_fit(cpu_req) == scan_first_fit(nodes, cpu_req)
+
+
+def test_rebuild_compacts_discarded_slots_and_keeps_order():
+    index = FirstFitIndex()
+    for i in range(64):
+        index.set(f"n{i}", 1)
+    for i in range(60):
+        index.discard(f"n{i}")
+    # Re-adding a discarded id puts it at the end, like re-inserting into a dict.
+    index.set("n0", 5)
+    for i in range(64, 200):
+        index.set(f"n{i}", 0)
+
+    assert index.first_fit(1) == "n60"
+    assert index.first_fit(2) == "n0"
+    assert index.first_fit(6) is None
+    for i in range(60, 64):
+        index.discard(f"n{i}")
+    assert index.first_fit(1) == "n0"
+    assert index.first_fit(0) == "n0"
+    index.discard("n0")
+    assert index.first_fit(0) == "n64"
+    assert index.first_fit(1) is None